@@ -1,38 +1,22 @@
 # populate_db.py
-import sqlite3
 import os
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from storage import SQLiteBackend
+
 load_dotenv()
 
 DB_PATH = os.getenv("SQLITE_PATH")
-DB_DIR = os.path.dirname(DB_PATH)
-
-# Create the database directory if it doesn't exist
-if DB_DIR:
-    os.makedirs(DB_DIR, exist_ok=True)
-
-# Connect to SQLite
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
 
-# Drop table if it exists to make script re-runnable
-cursor.execute("DROP TABLE IF EXISTS ray_jobs;")
+# Open the database as its writer (this creates the directory if needed)
+storage = SQLiteBackend(DB_PATH)
 
-# Create the table
-cursor.execute("""
-    CREATE TABLE ray_jobs (
-        job_name TEXT PRIMARY KEY,
-        status TEXT,
-        logs TEXT,
-        start_time TIMESTAMP,
-        end_time TIMESTAMP
-    );
-""")
+# Drop tables if they exist to make script re-runnable, then recreate them empty
+storage.drop_schema()
+storage.init_schema()
 
 print(f"Database '{DB_PATH}' created and populated with sample data successfully.")
 
 # Close connection
-conn.commit()
-conn.close()
\ No newline at end of file
+storage.close()
\ No newline at end of file
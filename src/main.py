@@ -1,17 +1,31 @@
 import sqlite3
 import os
+import queue
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, Depends, HTTPException
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 
+from storage import connect_readonly
+
 # Load environment variables from .env file (for local development)
 load_dotenv()
 
 # --- Configuration ---
 # This path should match the one used by your poller.py script.
 DB_PATH = os.getenv("SQLITE_PATH", "database/ray_jobs.db")
+# Max number of requests reading from the DB at once, and how long (in seconds)
+# a request waits for a free cursor before giving up with a 503.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_POOL_TIMEOUT = 2.0
+# The job lists only change when the poller writes, so they are cached for one poll interval.
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "60"))
+# Max number of jobs shown on a list page; older completed jobs are paged.
+JOB_LIST_LIMIT = 100
+# Shown on the details page for jobs the poller hasn't stored logs for yet.
+LOGS_PENDING_MESSAGE = "Logs are available after job completion."
 
 # --- FastAPI App Initialization ---
 app = FastAPI(title="Ray Jobs Dashboard")
@@ -19,63 +33,154 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 
-# --- Database Connection (Corrected for Threading) ---
-def get_db():
+# --- Database Connection (Shared, Read-Only) ---
+class CursorPool:
+    """
+    Fixed-size pool of cursors on one shared, read-only SQLite connection.
+    Bounds how many requests hit the DB concurrently, so a burst of traffic
+    queues up briefly instead of piling onto the poller's database file.
+    """
+    def __init__(self, conn, size):
+        self.conn = conn
+        self._cursors = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._cursors.put(conn.cursor())
+
+    def acquire(self, timeout):
+        """Takes a cursor from the pool. Raises queue.Empty on timeout."""
+        return self._cursors.get(timeout=timeout)
+
+    def release(self, cursor):
+        self._cursors.put(cursor)
+
+    def close(self):
+        self.conn.close()
+
+
+def open_db_pool():
     """
-    FastAPI dependency to get an SQLite DB connection safely.
-    - Connects with check_same_thread=False, which is required for FastAPI.
-    - Enables WAL for concurrent access.
-    - Handles cases where the DB file doesn't exist yet.
+    Opens the long-lived, read-only SQLite connection shared by all requests.
+    Returns None if the DB file doesn't exist yet (the poller creates it).
     """
-    conn = None
     try:
-        # THE FIX: Add check_same_thread=False to allow usage across FastAPI's threads.
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        
-        # Readers must also enable WAL mode to read from a WAL-enabled DB.
-        conn.execute("PRAGMA journal_mode=WAL;")
-        yield conn
+        conn = connect_readonly(DB_PATH)
     except sqlite3.OperationalError:
         print(f"WARNING: Database not found at {DB_PATH} or is not accessible. It will be created by the poller.")
+        return None
+    return CursorPool(conn, DB_POOL_SIZE)
+
+
+@app.on_event("startup")
+def open_shared_db():
+    app.state.db_pool = open_db_pool()
+
+
+@app.on_event("shutdown")
+def close_shared_db():
+    if app.state.db_pool:
+        app.state.db_pool.close()
+
+
+def get_db(request: Request):
+    """
+    FastAPI dependency lending a cursor from the shared pool for one request.
+    - Avoids re-opening the DB file and re-reading its schema on every request.
+    - Retries the connection if the DB didn't exist at startup.
+    - Returns 503 if no cursor frees up within DB_POOL_TIMEOUT seconds.
+    """
+    if request.app.state.db_pool is None:
+        request.app.state.db_pool = open_db_pool()
+    pool = request.app.state.db_pool
+    if pool is None:
         # If DB doesn't exist, yield None so endpoints can handle it gracefully.
         yield None
+        return
+
+    try:
+        cursor = pool.acquire(timeout=DB_POOL_TIMEOUT)
+    except queue.Empty:
+        raise HTTPException(status_code=503, detail="Server is busy. Please try again shortly.")
+    try:
+        yield cursor
     finally:
-        if conn:
-            conn.close()
+        pool.release(cursor)
+
+# --- Query Cache ---
+_query_cache = TTLCache(maxsize=32, ttl=POLL_INTERVAL)
+
+def cached_rows(key, fetch):
+    """Returns the cached rows for key, calling fetch() to load them on a miss."""
+    rows = _query_cache.get(key)
+    if rows is None:
+        rows = _query_cache[key] = fetch()
+    return rows
 
 # --- Endpoints (Updated for Robustness) ---
 
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request, db: sqlite3.Connection = Depends(get_db)):
+async def home(request: Request, db: sqlite3.Cursor = Depends(get_db)):
     """
     Home page: Shows jobs with status 'RUNNING', 'PENDING' or 'UNKNOWN'.
     """
     active_jobs = []
     # Check if the database connection was successful
     if db:
-        query = "SELECT job_name, status, logs, start_time, end_time FROM ray_jobs WHERE status IN ('RUNNING', 'PENDING', 'UNKNOWN') ORDER BY start_time DESC;"
-        active_jobs = db.execute(query).fetchall()
+        query = "SELECT job_name, status, start_time, end_time FROM ray_jobs WHERE status IN ('RUNNING', 'PENDING', 'UNKNOWN') ORDER BY start_time DESC LIMIT ?;"
+        active_jobs = cached_rows("home", lambda: db.execute(query, [JOB_LIST_LIMIT]).fetchall())
         
     return templates.TemplateResponse(
         "index.html", {"request": request, "jobs": active_jobs}
     )
 
+COMPLETED_JOBS_QUERY = "SELECT job_name, status, start_time, end_time FROM ray_jobs WHERE status NOT IN ('RUNNING', 'PENDING', 'UNKNOWN') AND {} ORDER BY end_time DESC, job_name DESC LIMIT ?;"
+
+def fetch_completed_page(db, before, before_job):
+    """
+    Returns one page of completed jobs, newest first. Jobs without an end time
+    come after all dated jobs, ordered by name. Each part is read with its own
+    range search on idx_ray_jobs_end, so the query can start right at the cursor.
+    """
+    jobs = []
+    # before="" means the previous page already reached the jobs without an end time.
+    if before != "":
+        if before is None:
+            condition, params = "end_time IS NOT NULL", []
+        else:
+            condition, params = "(end_time, job_name) < (?, ?)", [before, before_job]
+        jobs = db.execute(COMPLETED_JOBS_QUERY.format(condition), params + [JOB_LIST_LIMIT]).fetchall()
+
+    if len(jobs) < JOB_LIST_LIMIT:
+        if before == "":
+            condition, params = "end_time IS NULL AND job_name < ?", [before_job]
+        else:
+            condition, params = "end_time IS NULL", []
+        jobs += db.execute(COMPLETED_JOBS_QUERY.format(condition), params + [JOB_LIST_LIMIT - len(jobs)]).fetchall()
+    return jobs
+
 @app.get("/completed", response_class=HTMLResponse)
-async def completed_jobs(request: Request, db: sqlite3.Connection = Depends(get_db)):
+async def completed_jobs(
+    request: Request, before: str | None = None, before_job: str = "", db: sqlite3.Cursor = Depends(get_db)
+):
     """
-    Completed jobs page: Shows jobs with status NOT in 'RUNNING', 'PENDING' or 'UNKNOWN'.
+    Completed jobs page: Shows jobs with status NOT in 'RUNNING', 'PENDING' or 'UNKNOWN',
+    newest first, one page at a time. A page ends at the (end_time, job_name) of its last
+    row, which the next page passes back as before/before_job (keyset pagination).
     """
     jobs = []
     if db:
-        query = "SELECT job_name, status, logs, start_time, end_time FROM ray_jobs WHERE status NOT IN ('RUNNING', 'PENDING', 'UNKNOWN') ORDER BY end_time DESC;"
-        jobs = db.execute(query).fetchall()
-        
+        jobs = cached_rows(("completed", before, before_job), lambda: fetch_completed_page(db, before, before_job))
+
+    # A full page may have older jobs after it.
+    next_page = None
+    if len(jobs) == JOB_LIST_LIMIT:
+        next_page = {"before": jobs[-1][3] or "", "before_job": jobs[-1][0]}
+
     return templates.TemplateResponse(
-        "completed.html", {"request": request, "jobs": jobs}
+        "completed.html", {"request": request, "jobs": jobs, "next_page": next_page, "is_first_page": before is None}
     )
 
 @app.get("/jobs/{job_name}", response_class=HTMLResponse)
-async def job_details(job_name: str, request: Request, db: sqlite3.Connection = Depends(get_db)):
+async def job_details(job_name: str, request: Request, db: sqlite3.Cursor = Depends(get_db)):
     """
     Job details page: Shows detailed information for a single job.
     """
@@ -83,8 +188,12 @@ async def job_details(job_name: str, request: Request, db: sqlite3.Connection =
     if not db:
         raise HTTPException(status_code=503, detail="Database is not available yet. Please try again shortly.")
         
-    query = "SELECT job_name, status, logs, start_time, end_time FROM ray_jobs WHERE job_name = ?;"
-    job = db.execute(query, [job_name]).fetchone()
+    query = """
+        SELECT j.job_name, j.status, COALESCE(l.logs, ?), j.start_time, j.end_time
+        FROM ray_jobs j LEFT JOIN ray_job_logs l ON l.job_name = j.job_name
+        WHERE j.job_name = ?;
+    """
+    job = db.execute(query, [LOGS_PENDING_MESSAGE, job_name]).fetchone()
 
     if not job:
         raise HTTPException(status_code=440, detail=f"Job '{job_name}' not found")
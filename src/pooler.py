@@ -1,78 +1,149 @@
+import asyncio
+import codecs
+import io
 import os
-import time
+import signal
+import httpx
 import requests
-import sqlite3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
-import json
+
+from storage import SQLiteBackend, StorageBackend
+
+try:
+    # orjson parses large log payloads several times faster than the stdlib.
+    import orjson as _json
+except ImportError:
+    import json as _json
 
 # --- Configuration from Environment Variables ---
 NAMESPACE = os.getenv("POD_NAMESPACE", "default")
 API_BASE = os.getenv("KUBERAY_API_SERVER", "http://kuberay-apiserver-service.default.svc.cluster.local:8888")
 DB_PATH = os.getenv("SQLITE_PATH", "/app/database/ray_jobs.db")
 POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "60"))
+# Max number of log downloads from Ray dashboards in flight at the same time.
+LOG_FETCH_CONCURRENCY = int(os.getenv("LOG_FETCH_CONCURRENCY", "16"))
 
 TERMINAL_STATES = {"SUCCEEDED", "FAILED", "STOPPED"}
 
-def clean_raw_logs(raw_logs: str) -> str:
+# Matches ANSI escape sequences (colors, cursor moves) and box-drawing characters.
+# The box-drawing range is a plain (non-raw) string so RE2 sees the literal characters,
+# since it doesn't understand Python's \u escapes.
+_ANSI_PATTERN = r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])|' '[\u2500-\u257F]+'
+try:
+    # Optional: RE2 runs the pattern as a DFA, which is much faster on large logs.
+    import re2
+    _ANSI_RE = re2.compile(_ANSI_PATTERN)
+except ImportError:
+    _ANSI_RE = re.compile(_ANSI_PATTERN)
+
+def clean_raw_logs(raw_logs: str | bytes | bytearray) -> str:
     """
     Cleans raw log output by first attempting to parse it as JSON (as Ray often returns),
     and then stripping all ANSI/Unicode terminal formatting codes for clean display.
     """
     # 1. Try to parse as JSON, as the Ray dashboard API often wraps logs this way.
     try:
-        data = json.loads(raw_logs)
-        log_content = data.get('logs', '')
-        # Unescape characters like \\n and \\t
-        log_content = log_content.encode().decode('unicode_escape')
-    except (json.JSONDecodeError, TypeError):
-        # If it's not JSON or not a string, process it as plain text.
-        log_content = raw_logs if isinstance(raw_logs, str) else "Log content is not in a readable format."
+        # JSON decoding already turns escapes like \\n and \\t into real characters.
+        data = _json.loads(raw_logs)
+        log_content = data['logs']
+        if not isinstance(log_content, str):
+            raise TypeError("'logs' is not a string")
+    except (_json.JSONDecodeError, TypeError, KeyError):
+        # If it's not a JSON {"logs": "..."} payload, process it as plain text.
+        if isinstance(raw_logs, (bytes, bytearray)):
+            log_content = raw_logs.decode('utf-8', 'replace')
+        elif isinstance(raw_logs, str):
+            log_content = raw_logs
+        else:
+            log_content = "Log content is not in a readable format."
+
+    # 2. Remove ANSI/Unicode control characters using the precompiled pattern.
+    return _ANSI_RE.sub('', log_content)
+
+
+# Logs are streamed from the Ray dashboard in chunks of this size. An escape sequence
+# starting within the last _ANSI_MAX_LEN characters of a chunk may be cut off, so it
+# is carried over to the next chunk before stripping.
+_STREAM_CHUNK_SIZE = 65536
+_ANSI_MAX_LEN = 32
+
+async def clean_streamed_logs(response: httpx.Response) -> str:
+    """
+    Cleans a streamed log response without first buffering the whole body as text.
+    JSON payloads are collected as raw bytes and parsed and cleaned in a worker thread,
+    so other downloads keep progressing meanwhile; plain-text logs are decoded and
+    stripped chunk by chunk.
+    """
+    chunks = response.aiter_bytes(_STREAM_CHUNK_SIZE)
+    first = await anext(chunks, b'')
+
+    if first.lstrip()[:1] == b'{':
+        body = bytearray(first)
+        async for chunk in chunks:
+            body += chunk
+        return await asyncio.to_thread(clean_raw_logs, body)
 
-    # 2. Use a regular expression to remove ANSI/Unicode control characters.
-    # This pattern matches escape sequences for colors, box drawing, etc.
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])|[\u2500-\u257F]+')
-    return ansi_escape.sub('', log_content)
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    cleaned = io.StringIO()
+    tail = decoder.decode(first)
+    async for chunk in chunks:
+        text = tail + decoder.decode(chunk)
+        cut = text.rfind('\x1b', max(0, len(text) - _ANSI_MAX_LEN))
+        if cut == -1:
+            cut = len(text)
+        cleaned.write(_ANSI_RE.sub('', text[:cut]))
+        tail = text[cut:]
+    cleaned.write(_ANSI_RE.sub('', tail + decoder.decode(b'', final=True)))
+    return cleaned.getvalue()
 
 
 class RayJobManager:
     """Manages fetching, processing, and cleaning up RayJobs."""
-    def __init__(self, namespace, api_base):
+    def __init__(self, namespace, api_base, storage: StorageBackend):
         self.namespace = namespace
         self.api_base = api_base
+        self.storage = storage
+        # Rows queued by save_job_to_db, written in one transaction per cycle.
+        self._pending = []
+        # Last (status, start_time, end_time) saved per job, to skip writing unchanged jobs.
+        self._last_state = {}
         self._init_db()
 
+        # One session for all Kubernetes API calls, so connections (and TLS sessions)
+        # are reused across jobs and poll cycles instead of reopened per request.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=2, backoff_factor=0.2))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Client for Ray dashboard log downloads, kept open across poll cycles.
+        self._http = httpx.AsyncClient(timeout=15, limits=httpx.Limits(max_connections=32))
+
+    async def close(self):
+        """Closes the HTTP clients and the storage backend."""
+        await self._http.aclose()
+        self.session.close()
+        self.storage.close()
+
     def _init_db(self):
-        """Ensures the database and table exist and enables WAL mode."""
-        print(f"Initializing database at {DB_PATH}...")
-        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-        
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            # CRITICAL: Enable WAL mode for concurrent read/write.
-            cursor.execute("PRAGMA journal_mode=WAL;")
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ray_jobs (
-                    job_name TEXT PRIMARY KEY,
-                    status TEXT,
-                    logs TEXT,
-                    start_time TIMESTAMP,
-                    end_time TIMESTAMP
-                )
-            """)
+        """Ensures the database tables and indexes exist."""
+        print("Initializing database...")
+        self.storage.init_schema()
         print("Database initialized successfully.")
 
     def get_all_jobs(self):
         """Fetches all RayJob resources from the Kubernetes API."""
         url = f"{self.api_base}/apis/ray.io/v1/namespaces/{self.namespace}/rayjobs"
         try:
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=10)
             response.raise_for_status()
             return response.json().get("items", [])
         except requests.exceptions.RequestException as e:
             print(f"❌ Error fetching RayJobs: {e}")
             return []
 
-    def get_job_logs(self, job_name, job_details):
+    async def get_job_logs(self, job_name, job_details):
         """Fetches and cleans logs for a given job from the Ray Dashboard."""
         dashboard_url = job_details.get('dashboardURL')
         job_id = job_details.get('jobId')
@@ -83,22 +154,52 @@ class RayJobManager:
 
         url = f"http://{dashboard_url}/api/jobs/{job_id}/logs"
         try:
-            response = requests.get(url, timeout=15)
-            if response.status_code == 200:
-                # The cleaning function is now robust
-                return clean_raw_logs(response.text)
-            else:
-                print(f"❌ Failed to fetch logs for {job_name} (Status {response.status_code}) from {url}")
-                return f"Failed to fetch logs. Status: {response.status_code}"
-        except requests.exceptions.RequestException as e:
+            # Stream the body so large logs aren't buffered in full before cleaning.
+            async with self._http.stream("GET", url) as response:
+                if response.status_code == 200:
+                    return await clean_streamed_logs(response)
+                else:
+                    print(f"❌ Failed to fetch logs for {job_name} (Status {response.status_code}) from {url}")
+                    return f"Failed to fetch logs. Status: {response.status_code}"
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
             print(f"❌ Exception while fetching logs for {job_name}: {e}")
             return f"Failed to fetch logs due to a network error: {e}"
 
+    async def save_finished_jobs(self, finished_jobs):
+        """
+        Fetches logs for all finished jobs concurrently and queues them for saving.
+        A new download only starts once one of the LOG_FETCH_CONCURRENCY in-flight
+        downloads completes, so a burst of finished jobs can't exhaust sockets or memory.
+        """
+        pending = {}
+
+        def save_done(done):
+            for task in done:
+                job_name, status, start_time, end_time = pending.pop(task)
+                try:
+                    logs = task.result()
+                except Exception as e:
+                    # One bad download must not abort the cycle for every other job.
+                    print(f"❌ Unexpected error while fetching logs for {job_name}: {e}")
+                    logs = f"Failed to fetch logs due to an unexpected error: {e}"
+                self.save_job_to_db(job_name, status, logs, start_time, end_time)
+
+        for job_name, status, job_details, start_time, end_time in finished_jobs:
+            if len(pending) >= LOG_FETCH_CONCURRENCY:
+                done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                save_done(done)
+            task = asyncio.create_task(self.get_job_logs(job_name, job_details))
+            pending[task] = (job_name, status, start_time, end_time)
+
+        if pending:
+            done, _ = await asyncio.wait(pending.keys())
+            save_done(done)
+
     def delete_job(self, job_name):
         """Deletes a RayJob resource from the Kubernetes API."""
         url = f"{self.api_base}/apis/ray.io/v1/namespaces/{self.namespace}/rayjobs/{job_name}"
         try:
-            response = requests.delete(url, timeout=10)
+            response = self.session.delete(url, timeout=10)
             if 200 <= response.status_code < 300:
                 print(f"🗑️ Deleted job resource: {job_name}")
             else:
@@ -107,28 +208,45 @@ class RayJobManager:
             print(f"❌ Exception during job deletion for {job_name}: {e}")
 
     def save_job_to_db(self, job_name, status, logs, start_time, end_time):
-        """Saves or updates job information in the SQLite database correctly."""
+        """
+        Queues job information to be saved by the next flush_to_db() call.
+        Pass logs=None for jobs that have no logs yet; such a job is skipped
+        if nothing changed since it was last saved.
+        """
+        if logs is None and self._last_state.get(job_name) == (status, start_time, end_time):
+            return
+        self._pending.append((job_name, status, logs, start_time, end_time))
+
+    def flush_to_db(self):
+        """
+        Saves or updates all queued jobs in a single transaction, so a cycle costs
+        one commit instead of one per job. Returns True if the write succeeded.
+        """
+        if not self._pending:
+            return True
         try:
-            # The 'with' statement handles commit and close automatically.
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                # Ensure WAL mode is active for every connection.
-                cursor.execute("PRAGMA journal_mode=WAL;")
-                cursor.execute("""
-                    INSERT OR REPLACE INTO ray_jobs (job_name, status, logs, start_time, end_time) 
-                    VALUES (?, ?, ?, ?, ?)
-                """, (job_name, status, logs, start_time, end_time))
+            self.storage.bulk_upsert(self._pending)
+            for job_name, status, _, start_time, end_time in self._pending:
+                self._last_state[job_name] = (status, start_time, end_time)
+            return True
         except Exception as e:
-            print(f"❌ Database error for job {job_name}: {e}")
+            print(f"❌ Database error while saving {len(self._pending)} jobs: {e}")
+            return False
+        finally:
+            self._pending.clear()
 
-    def process_jobs(self):
+    async def process_jobs(self):
         """The main processing loop."""
         print("\n--- Starting job processing cycle ---")
+        # Drop rows left over from a cycle that failed before flushing; every job
+        # is re-read from the cluster below, so nothing is lost.
+        self._pending.clear()
         jobs = self.get_all_jobs()
         if not jobs:
             print("No RayJobs found in the cluster.")
             return
 
+        finished_jobs = []
         for job in jobs:
             job_name = job.get("metadata", {}).get("name")
             job_status_details = job.get("status", {})
@@ -144,21 +262,45 @@ class RayJobManager:
             
             if status in TERMINAL_STATES:
                 print(f"📌 Job '{job_name}' is in terminal state: {status}. Fetching logs and cleaning up.")
-                logs = self.get_job_logs(job_name, job_status_details)
-                self.save_job_to_db(job_name, status, logs, start_time, end_time)
-                self.delete_job(job_name)
+                finished_jobs.append((job_name, status, job_status_details, start_time, end_time))
             else:
-                self.save_job_to_db(job_name, status, "Logs are available after job completion.", start_time, end_time)
+                self.save_job_to_db(job_name, status, None, start_time, end_time)
 
-if __name__ == "__main__":
-    manager = RayJobManager(NAMESPACE, API_BASE)
+        await self.save_finished_jobs(finished_jobs)
+
+        # Only delete finished jobs once their logs are safely stored; otherwise
+        # they are picked up again on the next cycle.
+        if self.flush_to_db():
+            for job_name, *_ in finished_jobs:
+                self.delete_job(job_name)
+                self._last_state.pop(job_name, None)
+
+async def main():
+    manager = RayJobManager(NAMESPACE, API_BASE, SQLiteBackend(DB_PATH))
     print(f"Starting RayJob poller in namespace '{NAMESPACE}'. Polling every {POLL_INTERVAL} seconds.")
-    
-    while True:
-        try:
-            manager.process_jobs()
-        except Exception as e:
-            print(f"🚨 An unexpected error occurred in the main loop: {e}")
-        
-        time.sleep(POLL_INTERVAL)
+
+    # Stop cleanly between cycles when Kubernetes sends SIGTERM (or on Ctrl+C).
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        while not stop.is_set():
+            try:
+                await manager.process_jobs()
+            except Exception as e:
+                print(f"🚨 An unexpected error occurred in the main loop: {e}")
+
+            # Sleep until the next cycle, waking up early if asked to stop.
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await manager.close()
+        print("Poller stopped.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
 
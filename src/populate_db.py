@@ -1,37 +1,19 @@
-import sqlite3
 import os
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from storage import SQLiteBackend
+
 load_dotenv()
 
 DB_PATH = os.getenv("SQLITE_PATH", "database/ray_jobs.db")
-DB_DIR = os.path.dirname(DB_PATH)
-
-# Create the database directory if it doesn't exist
-if DB_DIR:
-    os.makedirs(DB_DIR, exist_ok=True)
-
-# Connect to SQLite
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
-
-# Enable WAL mode so it's consistent with the application
-cursor.execute("PRAGMA journal_mode=WAL;")
 
-# Drop table if it exists to make script re-runnable
-cursor.execute("DROP TABLE IF EXISTS ray_jobs;")
+# Open the database as its writer (this creates the directory if needed)
+storage = SQLiteBackend(DB_PATH)
 
-# Create the table
-cursor.execute("""
-    CREATE TABLE ray_jobs (
-        job_name TEXT PRIMARY KEY,
-        status TEXT,
-        logs TEXT,
-        start_time TIMESTAMP,
-        end_time TIMESTAMP
-    );
-""")
+# Drop tables if they exist to make script re-runnable, then recreate them
+storage.drop_schema()
+storage.init_schema()
 
 # Sample data
 now = datetime.now()
@@ -74,10 +56,9 @@ jobs = [
 ]
 
 # Insert data
-cursor.executemany("INSERT INTO ray_jobs VALUES (?, ?, ?, ?, ?)", jobs)
+storage.bulk_upsert(jobs)
 
 print(f"Database '{DB_PATH}' created and populated with sample data successfully.")
 
-# Commit changes and close the connection
-conn.commit()
-conn.close()
+# Close the connection
+storage.close()
@@ -0,0 +1,130 @@
+import fcntl
+import os
+import sqlite3
+from typing import Protocol
+
+
+class StorageBackend(Protocol):
+    """What the poller needs from its database."""
+    def init_schema(self): ...
+    def bulk_upsert(self, rows): ...
+    def close(self): ...
+
+
+class SQLiteBackend:
+    """
+    The single writer of the ray_jobs database. All DDL lives here, so the poller,
+    the web app's queries and the sample-data scripts always see the same tables
+    and indexes.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._acquire_writer_lock()
+
+        # isolation_level=None: transactions are managed explicitly with BEGIN/COMMIT.
+        self.conn = sqlite3.connect(db_path, isolation_level=None)
+        # CRITICAL: Enable WAL mode for concurrent read/write. It is stored in the
+        # DB file, so setting it again on later starts is a no-op.
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        # Safe under WAL: commits skip the fsync, which happens at checkpoint time instead.
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+
+    def _acquire_writer_lock(self):
+        """
+        Ensures this is the database's only writer. The web app only reads, so a
+        second poller would just fight this one for SQLite's write lock and
+        process every job twice; it refuses to start instead.
+        """
+        self._writer_lock = open(f"{self.db_path}.writer.lock", "w")
+        try:
+            fcntl.flock(self._writer_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._writer_lock.close()
+            raise RuntimeError(f"Another poller is already writing to {self.db_path}.")
+
+    def close(self):
+        self.conn.close()
+        self._writer_lock.close()
+
+    def init_schema(self):
+        """Ensures the tables and indexes exist, migrating older databases."""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ray_jobs (
+                job_name TEXT PRIMARY KEY,
+                status TEXT,
+                start_time TIMESTAMP,
+                end_time TIMESTAMP
+            )
+        """)
+        # Logs live in their own table so the rows scanned by the list pages stay narrow.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ray_job_logs (
+                job_name TEXT PRIMARY KEY,
+                logs TEXT
+            )
+        """)
+        # Migrate databases created before the split, where logs were a ray_jobs column.
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(ray_jobs)")]
+        if "logs" in columns:
+            print("Moving logs from ray_jobs to ray_job_logs...")
+            cursor.execute("BEGIN")
+            cursor.execute("INSERT OR IGNORE INTO ray_job_logs (job_name, logs) SELECT job_name, logs FROM ray_jobs")
+            cursor.execute("ALTER TABLE ray_jobs DROP COLUMN logs")
+            cursor.execute("COMMIT")
+        # Serve the dashboard's list queries in index order, so they don't need a sort.
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ray_jobs_status_start ON ray_jobs (status, start_time)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ray_jobs_end ON ray_jobs (end_time, job_name)")
+
+    def drop_schema(self):
+        """Drops all tables. Used by the scripts that reset the database."""
+        self.conn.execute("DROP TABLE IF EXISTS ray_jobs")
+        self.conn.execute("DROP TABLE IF EXISTS ray_job_logs")
+
+    def bulk_upsert(self, rows):
+        """
+        Saves or updates (job_name, status, logs, start_time, end_time) rows in a
+        single transaction. Rows with logs=None leave the job's logs untouched.
+        Raises on failure, after rolling back.
+        """
+        try:
+            self.conn.execute("BEGIN")
+            # Upserts whose WHERE clause leaves identical rows untouched, so they aren't rewritten.
+            self.conn.executemany("""
+                INSERT INTO ray_jobs (job_name, status, start_time, end_time)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (job_name) DO UPDATE SET
+                    status = excluded.status, start_time = excluded.start_time, end_time = excluded.end_time
+                WHERE ray_jobs.status IS NOT excluded.status
+                    OR ray_jobs.start_time IS NOT excluded.start_time
+                    OR ray_jobs.end_time IS NOT excluded.end_time
+            """, [(job_name, status, start_time, end_time) for job_name, status, _, start_time, end_time in rows])
+            self.conn.executemany("""
+                INSERT INTO ray_job_logs (job_name, logs)
+                VALUES (?, ?)
+                ON CONFLICT (job_name) DO UPDATE SET logs = excluded.logs
+                WHERE ray_job_logs.logs IS NOT excluded.logs
+            """, [(job_name, logs) for job_name, _, logs, _, _ in rows if logs is not None])
+            self.conn.execute("COMMIT")
+        except Exception:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            raise
+
+
+def connect_readonly(db_path):
+    """
+    Opens a read-only connection for the web app. Raises sqlite3.OperationalError
+    if the DB file doesn't exist yet.
+    - Opens with mode=ro, so the web app can never write to the poller's database.
+    - Connects with check_same_thread=False, which is required for FastAPI.
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+    # Per-connection read tuning, run once per connection rather than per request.
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA mmap_size=268435456;")
+    conn.execute("PRAGMA cache_size=-65536;")
+    return conn